@@ -0,0 +1,144 @@
+"""Compact, memory-mapped LocKey distance matrix"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+class DistanceMatrix:
+    """
+    LocKey x LocKey distance matrix backed by a float32 .npy file.
+
+    - The matrix is memory-mapped read-only, so it is loaded lazily and
+      shared through the OS page cache by every process that opens it.
+    - LocKeys are stored in a sidecar <name>_keys.npy file and mapped to
+      integer row/column positions with a pandas Index.
+    - Lookups take whole routes (sequences of LocKeys) and are done with
+      numpy fancy indexing instead of per-pair .loc calls.
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = Path(path)
+        self.matrix = np.load(self.path, mmap_mode="r" if mmap else None)
+        self.keys = pd.Index(np.load(_keys_path(self.path)))
+
+        if self.matrix.shape != (len(self.keys), len(self.keys)):
+            raise ValueError(
+                f"Distance matrix {self.path} has shape {self.matrix.shape} "
+                f"but {len(self.keys)} LocKeys"
+            )
+
+    @classmethod
+    def from_csv(cls, csv_path, npy_path=None, mmap=True):
+        """
+        Open the binary matrix for csv_path, converting the CSV first if the
+        .npy file or its keys file is missing, or the CSV is newer than them.
+        The CSV is not needed once the binary files exist.
+        """
+        csv_path = Path(csv_path)
+        npy_path = Path(npy_path) if npy_path is not None else csv_path.with_suffix(".npy")
+        keys_path = _keys_path(npy_path)
+
+        if not npy_path.exists() or not keys_path.exists():
+            stale = True
+        elif csv_path.exists():
+            csv_mtime = csv_path.stat().st_mtime
+            stale = min(npy_path.stat().st_mtime, keys_path.stat().st_mtime) < csv_mtime
+        else:
+            stale = False
+
+        if stale:
+            convert_csv(csv_path, npy_path)
+
+        return cls(npy_path, mmap=mmap)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def indexer(self, lockeys, strict=True):
+        """
+        Integer positions of lockeys in the matrix.
+        Unknown LocKeys raise a KeyError, or map to -1 when strict is False.
+        """
+        idx = self.keys.get_indexer(pd.Index(lockeys))
+        if strict and (idx < 0).any():
+            missing = pd.Index(lockeys)[idx < 0].unique().tolist()
+            raise KeyError(f"LocKeys not in distance matrix: {missing[:10]}")
+        return idx
+
+    def distance(self, loc1, loc2):
+        """Distance from loc1 to loc2."""
+        i, j = self.indexer([loc1, loc2])
+        return float(self.matrix[i, j])
+
+    def leg_distances(self, route):
+        """Distances of each consecutive leg of route, as a float64 array."""
+        idx = self.indexer(route)
+        return self.matrix[idx[:-1], idx[1:]].astype(np.float64)
+
+    def route_cost(self, route):
+        """Total distance of walking route in order (open path)."""
+        idx = self.indexer(route)
+        return float(self.matrix[idx[:-1], idx[1:]].sum(dtype=np.float64))
+
+    def submatrix(self, lockeys):
+        """Distances between lockeys, as an in-memory len(lockeys) x len(lockeys) array."""
+        idx = self.indexer(lockeys)
+        return self.matrix[np.ix_(idx, idx)]
+
+    def to_frame(self, lockeys=None):
+        """Labeled DataFrame view of the matrix (or of lockeys only) for display."""
+        if lockeys is None:
+            return pd.DataFrame(np.asarray(self.matrix), index=self.keys, columns=self.keys)
+        return pd.DataFrame(self.submatrix(lockeys), index=lockeys, columns=lockeys)
+
+
+def _keys_path(npy_path):
+    return npy_path.with_name(f"{npy_path.stem}_keys.npy")
+
+
+def convert_csv(csv_path, npy_path):
+    """
+    Convert a distance matrix CSV (LocKeys as index and header) to a float32
+    .npy matrix plus its LocKey sidecar file.
+    """
+    csv_path, npy_path = Path(csv_path), Path(npy_path)
+    dist_df = pd.read_csv(csv_path, index_col=0)
+    dist_df.index = dist_df.index.astype(str)
+    # read_csv renames repeated headers ("a" -> "a.1"); use the raw header row
+    dist_df.columns = pd.read_csv(csv_path, header=None, nrows=1, dtype=str).iloc[0, 1:].to_numpy()
+
+    # Each LocKey must label exactly one row and one column
+    duplicates = dist_df.index[dist_df.index.duplicated()].union(
+        dist_df.columns[dist_df.columns.duplicated()]
+    )
+    if len(duplicates) > 0:
+        raise ValueError(
+            f"Distance matrix {csv_path} has duplicate labels for "
+            f"{len(duplicates)} LocKeys: {duplicates[:10].tolist()}"
+        )
+
+    # Refuse to write a matrix with NaN holes: every row LocKey needs a column
+    missing_cols = dist_df.index.difference(dist_df.columns)
+    if len(missing_cols) > 0:
+        raise ValueError(
+            f"Distance matrix {csv_path} has no column for "
+            f"{len(missing_cols)} LocKeys: {missing_cols[:10].tolist()}"
+        )
+
+    # ... and every distance must be numeric
+    dist_df = dist_df.reindex(columns=dist_df.index).apply(pd.to_numeric, errors="coerce")
+    bad_cells = dist_df.isna().stack()
+    bad_cells = bad_cells[bad_cells].index
+    if len(bad_cells) > 0:
+        raise ValueError(
+            f"Distance matrix {csv_path} has {len(bad_cells)} missing or non-numeric "
+            f"distances (from, to): {bad_cells[:10].tolist()}"
+        )
+
+    keys = dist_df.index.to_numpy(dtype=str)
+    np.save(_keys_path(npy_path), keys)
+    np.save(npy_path, dist_df.to_numpy(dtype=np.float32))
+    print(f"Converted {csv_path} to {npy_path} ({len(keys)} LocKeys)")
+    return npy_path
@@ -0,0 +1,353 @@
+"""Route improvement analysis: actual vs. optimal pick path per user-day"""
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+RESULT_COLUMNS = [
+    "UserID", "Date", "NumTasks", "NumLocations", "TotalDist", "ShortestPath", "Improve", "Percent",
+    "Solver", "HeuristicGap", "DroppedLocations",
+]
+
+# Largest route solved exactly, matching the original 15-location cut; Held-Karp is
+# O(n^2 * 2^n) (about 0.8 s per route at n=15) so bigger routes use the heuristic
+EXACT_MAX_LOCATIONS = 15
+
+# Memory-mapped distance matrix opened by each pool worker, set by _init_worker
+_shared_dist = None
+
+
+def held_karp_path_fixed_start(mat):
+    """
+    Exact shortest Hamiltonian path for asymmetric distances.
+    Start fixed at index 0; visit all nodes exactly once; end anywhere.
+    mat is an n x n distance matrix (nested lists or numpy array).
+    Returns (best_cost, route_indices)
+    """
+    n = len(mat)
+    mat = np.asarray(mat, dtype=float).tolist()
+    START = 0
+    FULL = (1 << n) - 1
+
+    if n == 1:
+        return 0.0, [START]
+
+    @lru_cache(None)
+    def dp(mask, last):
+        # min cost to start at START, visit exactly mask (includes START and last), end at last
+        if mask == (1 << START) and last == START:
+            return 0.0
+        if not (mask & (1 << last)) or not (mask & (1 << START)):
+            return float("inf")
+        if last == START and mask != (1 << START):
+            return float("inf")
+
+        prev_mask = mask & ~(1 << last)
+        best = float("inf")
+        m = prev_mask
+        while m:
+            p = (m & -m).bit_length() - 1
+            best = min(best, dp(prev_mask, p) + mat[p][last])
+            m &= (m - 1)
+        return best
+
+    # end anywhere (no return to START)
+    best_cost = float("inf")
+    best_last = None
+    for last in range(n):
+        if last == START:
+            continue
+        c = dp(FULL, last)
+        if c < best_cost:
+            best_cost = c
+            best_last = last
+
+    # Reconstruct
+    route = [None] * n
+    route[-1] = best_last
+    mask = FULL
+    last = best_last
+    for pos in range(n - 2, -1, -1):
+        route[pos] = None
+        prev_mask = mask & ~(1 << last)
+        if prev_mask == (1 << START):
+            route[pos] = START
+            break
+
+        best_p = None
+        best_val = float("inf")
+        m = prev_mask
+        while m:
+            p = (m & -m).bit_length() - 1
+            val = dp(prev_mask, p) + mat[p][last]
+            if val < best_val:
+                best_val = val
+                best_p = p
+            m &= (m - 1)
+        route[pos] = best_p
+        mask = prev_mask
+        last = best_p
+
+    return best_cost, route
+
+
+def path_cost(mat, route):
+    """Total distance of an open path visiting route in order."""
+    mat = np.asarray(mat, dtype=float)
+    route = np.asarray(route)
+    return float(mat[route[:-1], route[1:]].sum())
+
+
+def nearest_neighbor_path(mat):
+    """Greedy path from index 0, always moving to the closest unvisited location."""
+    n = len(mat)
+    visited = np.zeros(n, dtype=bool)
+    route = [0]
+    visited[0] = True
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, mat[route[-1]])
+        nxt = int(np.argmin(row))
+        route.append(nxt)
+        visited[nxt] = True
+    return np.array(route)
+
+
+def two_opt(mat, route, tol=1e-9):
+    """
+    Improve an open path by reversing segments (start stays fixed).
+
+    - Distances may be asymmetric, so the reversed segment is re-costed in
+      the opposite direction using prefix sums of forward/backward edges.
+    - Every candidate end point j is evaluated in one vector operation per i.
+    Returns (route, improved)
+    """
+    route = np.array(route)
+    n = len(route)
+    any_improved = False
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 1):
+            # F[k] / B[k]: cost of positions 0..k walked forward / backward
+            F = np.concatenate(([0.0], np.cumsum(mat[route[:-1], route[1:]])))
+            B = np.concatenate(([0.0], np.cumsum(mat[route[1:], route[:-1]])))
+            j = np.arange(i + 1, n)
+            old = mat[route[i - 1], route[i]] + F[j] - F[i]
+            new = mat[route[i - 1], route[j]] + B[j] - B[i]
+            has_next = j + 1 < n
+            jn = j[has_next]
+            old[has_next] += mat[route[jn], route[jn + 1]]
+            new[has_next] += mat[route[i], route[jn + 1]]
+            delta = new - old
+            k = int(np.argmin(delta))
+            if delta[k] < -tol:
+                route[i:j[k] + 1] = route[i:j[k] + 1][::-1]
+                improved = any_improved = True
+    return route, any_improved
+
+
+def or_opt(mat, route, max_segment=3, tol=1e-9):
+    """
+    Improve an open path by moving runs of 1..max_segment locations elsewhere.
+
+    - Segments keep their direction, so asymmetric distances are respected.
+    - All insertion points for a segment are evaluated in one vector operation.
+    Returns (route, improved)
+    """
+    route = np.array(route)
+    n = len(route)
+    any_improved = False
+    improved = True
+    while improved:
+        improved = False
+        for seg_len in range(1, max_segment + 1):
+            i = 1
+            while i + seg_len <= n:
+                seg = route[i:i + seg_len]
+                rest = np.concatenate((route[:i], route[i + seg_len:]))
+                removed = mat[route[i - 1], seg[0]]
+                if i + seg_len < n:
+                    removed += mat[seg[-1], route[i + seg_len]] - mat[route[i - 1], route[i + seg_len]]
+
+                # added[k]: extra cost of inserting seg right after rest[k]
+                added = np.empty(len(rest))
+                added[:-1] = mat[rest[:-1], seg[0]] + mat[seg[-1], rest[1:]] - mat[rest[:-1], rest[1:]]
+                added[-1] = mat[rest[-1], seg[0]]
+                k = int(np.argmin(added))
+                if added[k] - removed < -tol:
+                    route = np.concatenate((rest[:k + 1], seg, rest[k + 1:]))
+                    improved = any_improved = True
+                i += 1
+    return route, any_improved
+
+
+def heuristic_path_fixed_start(mat, max_rounds=50):
+    """
+    Approximate shortest Hamiltonian path for asymmetric distances.
+    Same interface as held_karp_path_fixed_start: start fixed at index 0,
+    end anywhere. Nearest-neighbor construction followed by alternating
+    2-opt and Or-opt local search until neither improves the path.
+    Returns (best_cost, route_indices)
+    """
+    mat = np.asarray(mat, dtype=float)
+    if len(mat) < 3:
+        route = np.arange(len(mat))
+        return path_cost(mat, route), route.tolist()
+
+    route = nearest_neighbor_path(mat)
+    for _ in range(max_rounds):
+        route, improved_2opt = two_opt(mat, route)
+        route, improved_oropt = or_opt(mat, route)
+        if not (improved_2opt or improved_oropt):
+            break
+    return path_cost(mat, route), route.tolist()
+
+
+def solve_path_fixed_start(mat, exact_threshold=EXACT_MAX_LOCATIONS):
+    """
+    Shortest path from index 0 through every location, exact when possible.
+    Uses Held-Karp up to exact_threshold locations and the heuristic above it.
+    Returns (best_cost, route_indices)
+    """
+    if len(mat) <= exact_threshold:
+        return held_karp_path_fixed_start(mat)
+    return heuristic_path_fixed_start(mat)
+
+
+def heuristic_gap(mat, exact_cost=None):
+    """
+    Percent by which the heuristic route is longer than the exact optimum.
+    Pass exact_cost if Held-Karp has already been run on mat.
+    """
+    if exact_cost is None:
+        exact_cost, _ = held_karp_path_fixed_start(mat)
+    heuristic_cost, _ = heuristic_path_fixed_start(mat)
+    return round((heuristic_cost - exact_cost) / exact_cost * 100, 2) if exact_cost > 0 else 0.0
+
+
+def _init_worker(npy_path):
+    """Memory-map the distance matrix in a pool worker (no copy)."""
+    global _shared_dist
+    _shared_dist = np.load(npy_path, mmap_mode="r")
+
+
+def _solve_user_day(task):
+    """
+    Compute actual and optimal route distance for one (UserID, date) task.
+    Routes small enough to solve exactly also get the heuristic's gap.
+    """
+    user_id, date, num_tasks, dropped, idx, exact_threshold = task
+    sub = _shared_dist[np.ix_(idx, idx)]
+    actual_dist = path_cost(sub, np.arange(len(idx)))
+    best_dist, _ = solve_path_fixed_start(sub, exact_threshold)
+    if len(idx) <= exact_threshold:
+        solver = "exact"
+        gap = heuristic_gap(sub, exact_cost=best_dist)
+    else:
+        solver = "heuristic"
+        gap = np.nan
+    improve = actual_dist - best_dist
+    percent_improve = improve / actual_dist if actual_dist > 0 else 0
+    percent_improve = round(percent_improve * 100, 2)
+    return (
+        user_id, date, num_tasks, len(idx), actual_dist, best_dist, improve, percent_improve,
+        solver, gap, dropped,
+    )
+
+
+def build_route_tasks(df, dist, max_locations=None, exact_threshold=EXACT_MAX_LOCATIONS,
+                      missing="raise"):
+    """
+    Group df once by (UserID, date) and build one solver task per user-day.
+
+    - Each task is (UserID, date, task rows, dropped rows, array of matrix row
+      indices, exact_threshold) holding the unique LocKeys in visit order, optionally
+      truncated to max_locations (None keeps the whole route).
+    - LocKeys missing from the distance matrix raise a KeyError, like
+      DistanceMatrix lookups. With missing="drop" those rows are skipped
+      instead (joining their neighbours directly), a warning with the count
+      is printed and each task records how many of its rows were dropped.
+    - User-days with fewer than 2 locations are skipped.
+    """
+    if missing not in ("raise", "drop"):
+        raise ValueError(f"missing must be 'raise' or 'drop', not {missing!r}")
+
+    work = pd.DataFrame({
+        "UserID": df["UserID"].to_numpy(),
+        "Date": df["Timestamp"].dt.date.to_numpy(),
+        "LocIdx": dist.indexer(df["LocKey"], strict=False),
+    })
+    unknown = work["LocIdx"] < 0
+    if unknown.any():
+        sample = pd.unique(df["LocKey"].to_numpy()[unknown.to_numpy()])[:10].tolist()
+        if missing == "raise":
+            raise KeyError(
+                f"{unknown.sum()} rows have LocKeys not in distance matrix: {sample} "
+                f"(pass missing='drop' to skip them)"
+            )
+        print(
+            f"Warning: dropped {unknown.sum()} of {len(work)} rows with LocKeys "
+            f"not in distance matrix: {sample}"
+        )
+    work["Dropped"] = unknown
+    groups = work.groupby(["UserID", "Date"], sort=True)
+    tasks_per_day = groups.size()
+    dropped_per_day = groups["Dropped"].sum()
+
+    tasks = []
+    for (user_id, date), locs in work[~unknown].groupby(["UserID", "Date"], sort=True)["LocIdx"]:
+        idx = pd.unique(locs.to_numpy())[:max_locations]
+        if len(idx) < 2:
+            continue
+        num_tasks = int(tasks_per_day.loc[(user_id, date)])
+        dropped = int(dropped_per_day.loc[(user_id, date)])
+        tasks.append((user_id, date, num_tasks, dropped, idx, exact_threshold))
+    return tasks
+
+
+def analyze_routes(df, dist, output_path=None, max_locations=None,
+                   exact_threshold=EXACT_MAX_LOCATIONS, missing="raise",
+                   max_workers=None, chunksize=16):
+    """
+    Compare actual vs. optimal route distance for every user-day in df.
+
+    - df needs UserID, Timestamp and LocKey columns (e.g. OE_detailed); each
+      row is one task, counted per user-day in NumTasks.
+    - dist is a DistanceMatrix (see distance_matrix.py).
+    - Routes with up to exact_threshold locations are solved exactly (and
+      report the heuristic's HeuristicGap); longer ones use the heuristic.
+    - Rows whose LocKey is not in dist raise a KeyError unless missing="drop";
+      DroppedLocations counts the rows skipped per user-day.
+    - Every worker process memory-maps the same .npy file, so the matrix is
+      shared through the page cache instead of copied to each worker.
+    - If output_path is given, the results table is written there as Parquet.
+    Returns the results DataFrame.
+    """
+    tasks = build_route_tasks(
+        df, dist, max_locations=max_locations, exact_threshold=exact_threshold,
+        missing=missing,
+    )
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_worker,
+        initargs=(str(dist.path),),
+    ) as pool:
+        results = list(pool.map(_solve_user_day, tasks, chunksize=chunksize))
+
+    results_df = pd.DataFrame(results, columns=RESULT_COLUMNS)
+
+    if output_path is not None:
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        results_df.to_parquet(output_path, index=False)
+        print(f"Wrote {len(results_df)} user-day routes to {output_path}")
+
+    return results_df